@@ -4,14 +4,44 @@ Privacy-first crypto trade analysis companion
 """
 
 import asyncio
+import html
 import logging
 import os
+import re
+import secrets
+import signal
+import time
+from dataclasses import dataclass
+from typing import Final, NamedTuple, Optional
+
+from aiohttp import web
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import Command, CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType
+)
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNotFound,
+    TelegramRetryAfter
+)
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.methods import (
+    CopyMessage,
+    ForwardMessage,
+    SendDocument,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    TelegramMethod
+)
 from aiogram.types import (
+    Chat,
     Message, 
     InlineKeyboardMarkup, 
     InlineKeyboardButton,
@@ -19,6 +49,7 @@ from aiogram.types import (
     CallbackQuery
 )
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Setup logging
 logging.basicConfig(
@@ -27,27 +58,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Load environment variables
+load_dotenv()
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Bot configuration, read from the environment once at startup"""
+    bot_token: str
+    mini_app_url: str
+    port: int
+    # Public base URL for webhook mode; without it the bot uses long polling
+    webhook_base_url: Optional[str]
+    webhook_secret: str
+
+
+CFG = Config(
+    bot_token=os.getenv("BOT_TOKEN", ""),
+    mini_app_url=os.getenv("MINI_APP_URL", "https://logiccrafterdz.github.io/realpnl/"),
+    port=int(os.environ.get("PORT", 10000)),
+    # Render sets RENDER_EXTERNAL_URL automatically
+    webhook_base_url=os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL"),
+    webhook_secret=os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+)
+
 # Router (defined at module level for handlers)
 router = Router()
 
-# Bot instance (will be set in main())
-bot = None
+# "[@]username" argument of /verify - must be a valid Telegram username
+_USERNAME_RE = re.compile(r"@?(?P<u>[A-Za-z0-9_]{3,32})")
 
 
-# ============ HANDLERS ============
+# ============ STATIC CONTENT ============
 
-@router.message(CommandStart())
-async def cmd_start(message: Message):
-    """Handle /start command - Welcome message with buttons"""
-    
-    # Get MINI_APP_URL from environment
-    mini_app_url = os.getenv("MINI_APP_URL", "https://logiccrafterdz.github.io/realpnl/")
-    
-    if not mini_app_url:
-        await message.answer("⚠️ Configuration error: MINI_APP_URL not set.")
-        return
-    
-    welcome_text = """
+WELCOME_TEXT: Final[str] = """
 🔍 <b>Welcome to RealPNL</b>
 
 The privacy-first crypto trade analyzer.
@@ -63,281 +107,629 @@ I never see or store your trades.</i>
 
 Choose an action below:
 """
+
+HELP_TEXT: Final[str] = """
+📚 <b>RealPNL Help</b>
+
+<b>Commands:</b>
+/start - Welcome & main menu
+/upload - Upload CSV trade history
+/verify @username - Check bot/channel activity
+/report - View your saved report
+/help - Show this help
+
+<b>CSV Format:</b>
+Your file should have these columns:
+• <code>date</code> - Trade timestamp (YYYY-MM-DD HH:MM:SS)
+• <code>symbol</code> - Token symbol (BTC, ETH, PEPE, etc.)
+• <code>action</code> - buy or sell
+• <code>price</code> - Price in USD
+• <code>amount</code> - Quantity traded
+• <code>fee_usd</code> - (Optional) Fee in USD
+
+<b>Privacy:</b>
+🔒 All trade data is processed in your browser
+🔒 Nothing is sent to our servers
+🔒 Reports are encrypted with your password
+
+<b>Need help?</b>
+Contact @your_support_username
+"""
+
+START_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(
+            text="📊 Upload CSV",
+            web_app=WebAppInfo(url=CFG.mini_app_url)
+        )
+    ],
+    [
+        InlineKeyboardButton(
+            text="✅ Verify Bot/Channel",
+            callback_data="verify_help"
+        )
+    ],
+    [
+        InlineKeyboardButton(
+            text="❓ Help",
+            callback_data="help"
+        )
+    ]
+])
+
+UPLOAD_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(
+            text="📊 Open Trade Analyzer",
+            web_app=WebAppInfo(url=CFG.mini_app_url)
+        )
+    ]
+])
+
+REPORT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(
+            text="📊 Open Report",
+            web_app=WebAppInfo(url=CFG.mini_app_url)
+        )
+    ]
+])
+
+UPLOAD_TEXT: Final[str] = (
+    "📊 <b>Upload Trade History</b>\n\n"
+    "Click the button below to open the analyzer and upload your CSV file.\n\n"
+    "<i>Required columns: date, symbol, action, price, amount</i>"
+)
+
+REPORT_TEXT: Final[str] = (
+    "📊 <b>Your Report</b>\n\n"
+    "If you have previously uploaded trades, your report is saved locally in the Mini App.\n\n"
+    "Click below to view:"
+)
+
+VERIFY_HELP_TEXT: Final[str] = (
+    "✅ <b>How to Verify a Bot/Channel</b>\n\n"
+    "Use the command:\n"
+    "<code>/verify @username</code>\n\n"
+    "Examples:\n"
+    "• <code>/verify @dexscreener</code>\n"
+    "• <code>/verify @whale_alert</code>\n\n"
+    "<i>Only public channels can be verified.</i>"
+)
+
+VERIFY_USAGE_TEXT: Final[str] = (
+    "⚠️ <b>Usage:</b> <code>/verify @username</code>\n\n"
+    "Example: <code>/verify @dexscreener</code>"
+)
+
+VERIFY_CHECKING_TEXT: Final[str] = "🔍 Checking @{username}..."
+
+# Note: Message count requires admin access, so we show a placeholder
+VERIFY_REPORT_TEXT: Final[str] = """
+📊 <b>Verification Report: @{username}</b>
+
+✅ Active
+📌 Type: {type}
+👥 Title: {title}
+{bio}
+🔍 <b>Public Alerts:</b> None detected
+
+<i>ℹ️ Note: Full message history requires channel admin access.</i>
+"""
+
+VERIFY_BIO_TEXT: Final[str] = "📝 Bio: <i>{description}</i>\n"
+
+VERIFY_NOT_FOUND_TEXT: Final[str] = (
+    "❌ <b>Cannot verify @{username}</b>\n\n"
+    "Possible reasons:\n"
+    "• Username doesn't exist\n"
+    "• Channel/bot is private\n"
+    "• Username is misspelled"
+)
+
+VERIFY_TIMEOUT_TEXT: Final[str] = (
+    "⏳ <b>Telegram is slow to answer for @{username}</b>\n\n"
+    "Please try again in a moment."
+)
+
+VERIFY_ERROR_TEXT: Final[str] = (
+    "⚠️ <b>Error checking @{username}</b>\n\n"
+    "Private channels and bots cannot be verified.\n"
+    "Only public channels are supported."
+)
+
+
+# ============ CHAT CACHE ============
+
+class ChatInfo(NamedTuple):
+    """Fields of a Chat shown in verification reports, HTML-escaped and ready to send"""
+    type: str
+    title: str
+    bio: str
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(
-                text="📊 Upload CSV",
-                web_app=WebAppInfo(url=mini_app_url)
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="✅ Verify Bot/Channel",
-                callback_data="verify_help"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="❓ Help",
-                callback_data="help"
-            )
-        ]
-    ])
+    @classmethod
+    def from_chat(cls, chat: Chat) -> "ChatInfo":
+        """Build report fields once, when the chat is cached"""
+        bio = ""
+        if chat.description:
+            # Truncate long descriptions before escaping
+            desc = html.escape(chat.description[:100])
+            if len(chat.description) > 100:
+                desc += "..."
+            bio = VERIFY_BIO_TEXT.format(description=desc)
+        
+        return cls(
+            type=chat.type.capitalize() if chat.type else "Unknown",
+            title=html.escape(chat.title or "N/A"),
+            bio=bio
+        )
+
+
+# Successful getChat lookups, keyed by lowercase username
+_chat_cache: TTLCache = TTLCache(maxsize=4096, ttl=600)
+
+# Usernames that were not found (shorter TTL)
+_missing_chat_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+# getChat lookups in flight, keyed by lowercase username
+_chat_lookups: dict = {}
+
+# Max seconds to wait for getChat in /verify
+VERIFY_TIMEOUT = 5.0
+
+
+async def _fetch_chat_info(bot: Bot, username: str, key: str) -> ChatInfo:
+    """Call getChat for @username and cache the result"""
+    try:
+        chat = await bot.get_chat(f"@{username}")
+    except (TelegramBadRequest, TelegramNotFound):
+        # Remember misses briefly so typos don't hit the API again
+        _missing_chat_cache[key] = True
+        raise
     
-    await message.answer(welcome_text, reply_markup=keyboard)
+    info = ChatInfo.from_chat(chat)
+    _chat_cache[key] = info
+    return info
+
+
+def _forget_chat_lookup(key: str, task: asyncio.Task):
+    """Drop a finished lookup; its error (if any) is handled by the waiters"""
+    _chat_lookups.pop(key, None)
+    if not task.cancelled():
+        task.exception()
+
+
+def lookup_chat_info(bot: Bot, username: str, key: str) -> asyncio.Task:
+    """
+    Return the getChat lookup task for a username, starting one if needed,
+    so concurrent cache misses for the same username share a single call.
+    """
+    task = _chat_lookups.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_chat_info(bot, username, key))
+        _chat_lookups[key] = task
+        task.add_done_callback(lambda t: _forget_chat_lookup(key, t))
+    return task
+
+
+# ============ RATE LIMITING ============
+
+# Methods that post a message to a chat and count against its per-chat limit
+_PACED_METHODS = (
+    SendMessage,
+    SendPhoto,
+    SendDocument,
+    SendMediaGroup,
+    CopyMessage,
+    ForwardMessage
+)
+
+
+class AdaptiveTokenBucket:
+    """Token bucket that halves its rate on flood control and slowly recovers"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        min_rate: float = 1.0,
+        recovery: float = 0.1
+    ):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.rate = rate
+        # Burst size; defaults to one second worth of tokens
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Raise the rate a little after a successful request"""
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_flood(self):
+        """Halve the rate after a 429 response"""
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, self.rate)
+
+    def is_idle(self) -> bool:
+        """True if the bucket has refilled completely and nobody is waiting"""
+        elapsed = time.monotonic() - self.updated
+        return not self._lock.locked() and self.tokens + elapsed * self.rate >= self.capacity
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Paces outgoing Bot API calls: global token bucket (30 req/s by default)
+    plus a per-chat bucket (1 msg/s with a burst of 3) for message sends.
+    Requests rejected with 429 are retried after `retry_after` seconds.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3
+    ):
+        self.bucket = AdaptiveTokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: dict = {}
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ):
+        chat_id = getattr(method, "chat_id", None)
+
+        # Telegram's per-chat limit is about messages sent to a numeric chat;
+        # lookups like getChat("@username") only go through the global bucket
+        if isinstance(method, _PACED_METHODS) and isinstance(chat_id, int):
+            chat_bucket = self._chat_buckets.get(chat_id)
+            if chat_bucket is None:
+                self._prune()
+                chat_bucket = AdaptiveTokenBucket(
+                    self.chat_rate,
+                    capacity=self.chat_burst,
+                    min_rate=self.chat_rate
+                )
+                self._chat_buckets[chat_id] = chat_bucket
+            await chat_bucket.acquire()
+
+        return await self._send(make_request, bot, method)
+
+    async def _send(self, make_request, bot, method):
+        """Send through the global bucket, retrying on flood control"""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.bucket.on_flood()
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control on {type(method).__name__}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+                continue
+
+            self.bucket.on_success()
+            return result
+
+    def _prune(self):
+        """Forget idle chats so the per-chat table doesn't grow forever"""
+        if len(self._chat_buckets) < 10000:
+            return
+
+        for chat_id, chat_bucket in list(self._chat_buckets.items()):
+            if chat_bucket.is_idle():
+                del self._chat_buckets[chat_id]
+
+
+# ============ SEND QUEUE ============
+
+class SendQueue:
+    """
+    Single outgoing path for static replies (menus, help texts).
+    A reply already queued for the same chat (and topic) with the same text
+    is dropped, so repeated button presses collapse into one message.
+    """
+
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: set = set()
+        self._tasks: list = []
+
+    @staticmethod
+    def _key(method: SendMessage) -> tuple:
+        return (
+            method.chat_id,
+            method.message_thread_id,
+            method.business_connection_id,
+            method.text
+        )
+
+    def put(self, method: SendMessage):
+        """
+        Queue a prepared send (e.g. from `message.answer(...)`, which keeps
+        the topic thread and business connection) unless the same message
+        is already waiting for this chat.
+        """
+        key = self._key(method)
+        if key in self._pending:
+            return
+
+        self._pending.add(key)
+        self._queue.put_nowait(method)
+
+    def start(self, bot: Bot):
+        """Spawn the sender workers (sending is paced by RateLimitMiddleware)"""
+        self._tasks = [
+            asyncio.create_task(self._worker(bot))
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Cancel the sender workers"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, bot: Bot):
+        while True:
+            method = await self._queue.get()
+            self._pending.discard(self._key(method))
+
+            try:
+                await bot(method)
+            except Exception:
+                logger.exception(f"Error sending queued message to {method.chat_id}")
+            finally:
+                self._queue.task_done()
+
+
+send_queue = SendQueue()
+
+
+# ============ HANDLERS ============
+
+@router.message(CommandStart())
+async def cmd_start(message: Message):
+    """Handle /start command - Welcome message with buttons"""
+    send_queue.put(message.answer(WELCOME_TEXT, reply_markup=START_KB))
 
 
 @router.message(Command("upload"))
 async def cmd_upload(message: Message):
     """Handle /upload command - Open Mini App"""
-    
-    # Get MINI_APP_URL from environment
-    mini_app_url = os.getenv("MINI_APP_URL", "https://logiccrafterdz.github.io/realpnl/")
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(
-                text="📊 Open Trade Analyzer",
-                web_app=WebAppInfo(url=mini_app_url)
-            )
-        ]
-    ])
-    
-    await message.answer(
-        "📊 <b>Upload Trade History</b>\n\n"
-        "Click the button below to open the analyzer and upload your CSV file.\n\n"
-        "<i>Required columns: date, symbol, action, price, amount</i>",
-        reply_markup=keyboard
-    )
+    send_queue.put(message.answer(UPLOAD_TEXT, reply_markup=UPLOAD_KB))
 
 
 @router.message(Command("verify"))
-async def cmd_verify(message: Message):
+async def cmd_verify(message: Message, command: CommandObject, bot: Bot):
     """Handle /verify @username command - Check channel activity"""
     
-    # Extract username from command
-    args = message.text.split(maxsplit=1)
+    # Validate username from the already-parsed command arguments
+    match = _USERNAME_RE.fullmatch((command.args or "").strip())
     
-    if len(args) < 2:
-        await message.answer(
-            "⚠️ <b>Usage:</b> <code>/verify @username</code>\n\n"
-            "Example: <code>/verify @dexscreener</code>"
-        )
+    if not match:
+        await message.answer(VERIFY_USAGE_TEXT)
         return
     
-    username = args[1].strip()
+    username = match.group("u")
+    
+    key = username.lower()
     
-    # Remove @ if present
-    if username.startswith("@"):
-        username = username[1:]
+    if key in _missing_chat_cache:
+        await message.answer(VERIFY_NOT_FOUND_TEXT.format(username=username))
+        return
     
-    await message.answer(f"🔍 Checking @{username}...")
+    info = _chat_cache.get(key)
     
     try:
-        # Try to get chat info
-        chat = await bot.get_chat(f"@{username}")
-        
-        # Get chat type
-        chat_type = chat.type
-        is_accessible = True
-        
-        # Build response
-        status = "✅ Active" if chat else "❌ Not found"
-        
-        response = f"""
-📊 <b>Verification Report: @{username}</b>
-
-{status}
-📌 Type: {chat_type.capitalize() if chat_type else 'Unknown'}
-👥 Title: {chat.title or 'N/A'}
-"""
-        
-        if chat.description:
-            # Truncate long descriptions
-            desc = chat.description[:100] + "..." if len(chat.description) > 100 else chat.description
-            response += f"📝 Bio: <i>{desc}</i>\n"
-        
-        # Note: Message count requires admin access, so we show a placeholder
-        response += """
-🔍 <b>Public Alerts:</b> None detected
-
-<i>ℹ️ Note: Full message history requires channel admin access.</i>
-"""
-        
-        await message.answer(response)
+        if info is None:
+            # Send the "checking" notice while the lookup is in flight
+            checking_task = asyncio.create_task(
+                message.answer(VERIFY_CHECKING_TEXT.format(username=username))
+            )
+            
+            # Try to get chat info; shield the shared lookup so one caller
+            # timing out doesn't cancel it for the others
+            try:
+                info = await asyncio.wait_for(
+                    asyncio.shield(lookup_chat_info(bot, username, key)),
+                    timeout=VERIFY_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out verifying {username}")
+                reply = VERIFY_TIMEOUT_TEXT
+            except TelegramRetryAfter:
+                # Flood-control retries are already done by RateLimitMiddleware
+                logger.warning(f"Flood control while verifying {username}")
+                reply = VERIFY_TIMEOUT_TEXT
+            except (TelegramBadRequest, TelegramNotFound):
+                reply = VERIFY_NOT_FOUND_TEXT
+            except Exception:
+                logger.exception(f"Error verifying {username}")
+                reply = VERIFY_ERROR_TEXT
+            finally:
+                await checking_task
+            
+            if info is None:
+                await message.answer(reply.format(username=username))
+                return
         
-    except Exception as e:
-        error_msg = str(e).lower()
+        await message.answer(VERIFY_REPORT_TEXT.format_map({
+            "username": username,
+            "type": info.type,
+            "title": info.title,
+            "bio": info.bio
+        }))
         
-        if "chat not found" in error_msg or "bad request" in error_msg:
-            await message.answer(
-                f"❌ <b>Cannot verify @{username}</b>\n\n"
-                "Possible reasons:\n"
-                "• Username doesn't exist\n"
-                "• Channel/bot is private\n"
-                "• Username is misspelled"
-            )
-        else:
-            logger.error(f"Error verifying {username}: {e}")
-            await message.answer(
-                f"⚠️ <b>Error checking @{username}</b>\n\n"
-                "Private channels and bots cannot be verified.\n"
-                "Only public channels are supported."
-            )
+    except TelegramRetryAfter:
+        # Sending the answer itself hit flood control after all retries
+        logger.warning(f"Flood control while answering /verify for {username}")
 
 
 @router.message(Command("report"))
 async def cmd_report(message: Message):
     """Handle /report command - Show report button if exists"""
-    
-    # Get MINI_APP_URL from environment
-    mini_app_url = os.getenv("MINI_APP_URL", "https://logiccrafterdz.github.io/realpnl/")
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(
-                text="📊 Open Report",
-                web_app=WebAppInfo(url=mini_app_url)
-            )
-        ]
-    ])
-    
-    await message.answer(
-        "📊 <b>Your Report</b>\n\n"
-        "If you have previously uploaded trades, your report is saved locally in the Mini App.\n\n"
-        "Click below to view:",
-        reply_markup=keyboard
-    )
+    send_queue.put(message.answer(REPORT_TEXT, reply_markup=REPORT_KB))
 
 
 @router.message(Command("help"))
-async def cmd_help(message: Message):
-    """Handle /help command"""
-    await send_help(message)
+async def handle_help(message: Message):
+    """Handle /help command - Send help message"""
+    send_queue.put(message.answer(HELP_TEXT))
 
 
 @router.callback_query(F.data == "help")
 async def callback_help(callback: CallbackQuery):
     """Handle help button callback"""
-    await send_help(callback.message)
+    await handle_help(callback.message)
     await callback.answer()
 
 
 @router.callback_query(F.data == "verify_help")
 async def callback_verify_help(callback: CallbackQuery):
     """Handle verify help callback"""
-    await callback.message.answer(
-        "✅ <b>How to Verify a Bot/Channel</b>\n\n"
-        "Use the command:\n"
-        "<code>/verify @username</code>\n\n"
-        "Examples:\n"
-        "• <code>/verify @dexscreener</code>\n"
-        "• <code>/verify @whale_alert</code>\n\n"
-        "<i>Only public channels can be verified.</i>"
-    )
+    send_queue.put(callback.message.answer(VERIFY_HELP_TEXT))
     await callback.answer()
 
 
-async def send_help(message: Message):
-    """Send help message"""
-    help_text = """
-📚 <b>RealPNL Help</b>
+# ============ WEB SERVER (health check + webhook, for Render) ============
 
-<b>Commands:</b>
-/start - Welcome & main menu
-/upload - Upload CSV trade history
-/verify @username - Check bot/channel activity
-/report - View your saved report
-/help - Show this help
+# Path Telegram posts updates to in webhook mode
+WEBHOOK_PATH = "/webhook"
 
-<b>CSV Format:</b>
-Your file should have these columns:
-• <code>date</code> - Trade timestamp (YYYY-MM-DD HH:MM:SS)
-• <code>symbol</code> - Token symbol (BTC, ETH, PEPE, etc.)
-• <code>action</code> - buy or sell
-• <code>price</code> - Price in USD
-• <code>amount</code> - Quantity traded
-• <code>fee_usd</code> - (Optional) Fee in USD
 
-<b>Privacy:</b>
-🔒 All trade data is processed in your browser
-🔒 Nothing is sent to our servers
-🔒 Reports are encrypted with your password
+async def health(request: web.Request) -> web.Response:
+    """Simple HTTP handler for Render health checks"""
+    return web.Response(text="OK")
 
-<b>Need help?</b>
-Contact @your_support_username
-"""
-    await message.answer(help_text)
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    """Serve the aiohttp app on the bot's event loop"""
+    # access_log=None keeps the console clean
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", CFG.port).start()
+    
+    print(f"✅ Web server running on port {CFG.port}")
+    return runner
 
 
 # ============ MAIN ============
 
 async def main():
     """Start the bot"""
-    global bot
-    
-    # Load environment variables
-    load_dotenv()
+    if not CFG.bot_token:
+        raise ValueError("BOT_TOKEN is required")
     
-    # Configuration
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    MINI_APP_URL = os.getenv("MINI_APP_URL", "https://example.github.io/clearsignal/")
+    if not CFG.mini_app_url:
+        raise ValueError("MINI_APP_URL must not be empty")
     
-    if not BOT_TOKEN:
-        raise ValueError("BOT_TOKEN is required")
+    # Shared HTTP session: bigger pool and keep-alive so bursts reuse open
+    # TLS connections to the Bot API. Needs aiogram >= 3.8.0 for the `limit`
+    # argument; aiogram's own ttl_dns_cache=3600 is kept
+    session = AiohttpSession(limit=256, timeout=30)
+    session._connector_init.update(
+        limit_per_host=128,
+        keepalive_timeout=75
+    )
     
     # Initialize bot (aiogram >= 3.7.0 syntax)
     bot = Bot(
-        token=BOT_TOKEN,
+        token=CFG.bot_token,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+
+    # Throttle outgoing API calls to stay under Telegram's limits
+    bot.session.middleware(RateLimitMiddleware())
     
+    # Workers for queued static replies
+    send_queue.start(bot)
+
     # Initialize dispatcher
     dp = Dispatcher()
     dp.include_router(router)
     
-    print("✅ RealPNL Bot is starting...")
-    await dp.start_polling(bot)
-
-
-# ============ HEALTH CHECK SERVER (for Render) ============
-
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
-
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    """Simple HTTP handler for Render health checks"""
+    # Health check (and webhook) share one aiohttp app on the same event loop
+    app = web.Application()
+    app.router.add_get("/health", health)
     
-    def do_GET(self):
-        if self.path == "/health":
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-        else:
-            self.send_response(404)
-            self.end_headers()
+    if CFG.webhook_base_url:
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=CFG.webhook_secret
+        ).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
     
-    def log_message(self, format, *args):
-        """Suppress HTTP logs to keep console clean"""
-        pass
-
-
-def run_health_server():
-    """Run HTTP server for health checks"""
-    port = int(os.environ.get("PORT", 10000))
-    server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
-    print(f"✅ Health server running on port {port}")
-    server.serve_forever()
+    runner = await start_web_server(app)
+    
+    print("✅ RealPNL Bot is starting...")
+    try:
+        if CFG.webhook_base_url:
+            await bot.set_webhook(
+                f"{CFG.webhook_base_url.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=CFG.webhook_secret,
+                drop_pending_updates=True
+            )
+            print("✅ Webhook mode")
+            
+            # Updates are handled by the web server from here on;
+            # wait for SIGINT/SIGTERM (Render stops services with SIGTERM)
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:
+                    # Windows: Ctrl+C cancels asyncio.run() instead
+                    pass
+            await stop.wait()
+        else:
+            # Polling does not work while a webhook is set
+            await bot.delete_webhook()
+            print("✅ Polling mode")
+            await dp.start_polling(bot)
+    finally:
+        await send_queue.stop()
+        await runner.cleanup()
+        await session.close()
 
 
 if __name__ == "__main__":
-    # Start health check server in a separate daemon thread
-    health_thread = threading.Thread(target=run_health_server, daemon=True)
-    health_thread.start()
-    
+    # Use uvloop when available (not supported on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     # Start Telegram bot (main loop)
     asyncio.run(main())
-